@@ -1,15 +1,33 @@
 import networkx as nx
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Tuple
 import numpy as np
 from datetime import datetime
 import logging
-from collections import defaultdict
+from collections import Counter, OrderedDict
+import hashlib
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Columns of the per-commit attribute table and their defaults
+COMMIT_COLUMNS = {
+    'message': '',
+    'author': None,
+    'date': None,
+    'files_count': 0,
+    'is_initial': False,
+    'files_changed': [],
+    'analysis': '',
+    'code': None
+}
+
 class GraphProcessor:
+    # Degrees, layout, edges and metrics keyed by topology fingerprint, shared across
+    # instances; commits are immutable per SHA, so only node records vary between runs
+    _layout_cache: "OrderedDict[str, Tuple]" = OrderedDict()
+    _layout_cache_size = 32
+
     def __init__(self, graph: nx.DiGraph):
         """
         Initialize the GraphProcessor with a NetworkX DiGraph.
@@ -19,7 +37,12 @@ class GraphProcessor:
         """
         self.graph = graph
         self.layout = None
-        logger.info(f"Initialized GraphProcessor with graph containing {self.graph.number_of_nodes()} nodes")
+        self._node_idx: Dict[str, int] = {}
+        self._layout_xyz: Optional[np.ndarray] = None
+        self._in_deg: Dict[str, int] = {}
+        self._out_deg: Dict[str, int] = {}
+        self.commits, self._sha_idx = self._commit_table()
+        logger.info("Initialized GraphProcessor with graph containing %d nodes", self.graph.number_of_nodes())
 
     def process_for_visualization(self) -> Dict:
         """
@@ -42,29 +65,79 @@ class GraphProcessor:
                     'metrics': self._calculate_metrics()
                 }
 
-            # Calculate layout
-            self.layout = self._calculate_layout()
-            logger.info("Layout calculation completed")
+            fingerprint = self._graph_fingerprint()
+            cached = self._layout_cache.get(fingerprint)
+            if cached is not None:
+                self._layout_cache.move_to_end(fingerprint)
+                logger.info("Using cached layout")
+                self._in_deg, self._out_deg, self.layout, edges, metrics = cached
+            else:
+                # Degree lookups shared by node, edge and metric processing
+                self._in_deg = dict(self.graph.in_degree())
+                self._out_deg = dict(self.graph.out_degree())
+
+                # Calculate layout
+                self.layout = self._calculate_layout()
+                logger.info("Layout calculation completed")
+
+                # Process edges and calculate metrics
+                edges = self._process_edges()
+                metrics = self._calculate_metrics()
+
+                self._layout_cache[fingerprint] = (self._in_deg, self._out_deg, self.layout, edges, metrics)
+                if len(self._layout_cache) > self._layout_cache_size:
+                    self._layout_cache.popitem(last=False)
 
-            # Process nodes and edges
+            # Node records carry this run's commit analysis, so always rebuild them
             nodes = self._process_nodes()
-            edges = self._process_edges()
             
-            # Calculate metrics
-            metrics = self._calculate_metrics()
-            
-            logger.info(f"Processed {len(nodes)} nodes and {len(edges)} edges")
+            logger.info("Processed %d nodes and %d edges", len(nodes), len(edges))
             
             return {
                 'nodes': nodes,
-                'edges': edges,
-                'metrics': metrics
+                'edges': list(edges),
+                'metrics': dict(metrics)
             }
             
         except Exception as e:
             logger.error(f"Error in process_for_visualization: {str(e)}")
             raise
 
+    def _commit_table(self) -> Tuple[Dict[str, List], Dict[str, int]]:
+        """
+        Get the columnar commit attribute table for the graph.
+        
+        Graphs built by RepositoryAnalyzer carry the table in graph.graph;
+        otherwise it is assembled from the node attributes.
+        
+        Returns:
+            Tuple[Dict, Dict]: Column name -> values, and sha -> row index
+        """
+        table = self.graph.graph.get('commits')
+        sha_idx = self.graph.graph.get('sha_idx')
+        if table is not None and sha_idx is not None:
+            return table, sha_idx
+        
+        shas = list(self.graph.nodes())
+        table = {'sha': shas}
+        for column, default in COMMIT_COLUMNS.items():
+            table[column] = [self.graph.nodes[n].get(column, default) for n in shas]
+        return table, {sha: row for row, sha in enumerate(shas)}
+
+    def _graph_fingerprint(self) -> str:
+        """
+        Compute a fingerprint of the graph's topology (commit SHAs and edges).
+        
+        Returns:
+            str: Hex digest identifying the graph
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        for node in sorted(self.graph.nodes()):
+            digest.update(f"{node}\n".encode())
+        for source, target in sorted(self.graph.edges()):
+            digest.update(f"{source}>{target}".encode())
+        return digest.hexdigest()
+
     def _calculate_layout(self) -> Dict[str, Dict[str, float]]:
         """
         Calculate the layout positions for all nodes.
@@ -73,40 +146,32 @@ class GraphProcessor:
             Dict: Node positions in 3D space
         """
         try:
-            # Find root nodes (nodes with no incoming edges)
-            roots = [n for n in self.graph.nodes() if self.graph.in_degree(n) == 0]
-            if not roots:
-                # If no root found, use node with minimum in-degree
-                roots = [min(self.graph.nodes(), key=lambda n: self.graph.in_degree(n))]
-            
-            # Calculate levels based on longest path from any root
+            # Calculate levels as the longest path from any root, processing
+            # nodes in topological order so each level is computed once
             levels = {}
-            for node in self.graph.nodes():
-                max_distance = 0
-                for root in roots:
-                    try:
-                        distance = nx.shortest_path_length(self.graph, root, node)
-                        max_distance = max(max_distance, distance)
-                    except nx.NetworkXNoPath:
-                        continue
-                levels[node] = max_distance
-
-            # Create a temporary graph for layout calculation
-            temp_graph = self.graph.copy()
-            for node in temp_graph.nodes():
-                temp_graph.nodes[node]['subset'] = levels[node]
+            for node in nx.topological_sort(self.graph):
+                preds = list(self.graph.predecessors(node))
+                levels[node] = 1 + max(levels[p] for p in preds) if preds else 0
 
-            # Calculate initial layout
-            pos = nx.multipartite_layout(temp_graph, subset_key='subset', scale=100)
+            # Tag levels in place for the layout, then clean up
+            nx.set_node_attributes(self.graph, levels, 'subset')
+            try:
+                pos = nx.multipartite_layout(self.graph, subset_key='subset', scale=100)
+            finally:
+                for node in self.graph.nodes():
+                    self.graph.nodes[node].pop('subset', None)
 
-            # Convert to 3D coordinates with proper scaling
-            layout_3d = {}
-            for node, pos_2d in pos.items():
-                layout_3d[node] = {
-                    'x': float(pos_2d[0]),
-                    'y': float(pos_2d[1]),
-                    'z': float(levels[node] * 10)  # Use level for Z-coordinate
-                }
+            # Convert to 3D coordinates as one (N, 3) array, using level for Z
+            order = list(self.graph.nodes())
+            self._node_idx = {node: i for i, node in enumerate(order)}
+            self._layout_xyz = np.empty((len(order), 3), dtype=np.float64)
+            self._layout_xyz[:, :2] = [pos[node] for node in order]
+            self._layout_xyz[:, 2] = [levels[node] * 10 for node in order]
+            
+            layout_3d = {
+                node: {'x': x, 'y': y, 'z': z}
+                for node, (x, y, z) in zip(order, self._layout_xyz.tolist())
+            }
 
             logger.info("Layout calculation successful")
             return layout_3d
@@ -123,28 +188,30 @@ class GraphProcessor:
             List[Dict]: Processed node data
         """
         try:
-            nodes = []
-            for node in self.graph.nodes():
-                node_data = self.graph.nodes[node]
-                position = self.layout[node]
-                
-                # Process node attributes with defaults
-                processed_node = {
-                    'id': node,
-                    'position': position,
+            in_deg = self._in_deg
+            table = self.commits
+            
+            # Emit records straight from the commit table columns
+            nodes = [
+                {
+                    'id': sha,
+                    'position': self.layout[sha],
                     'data': {
-                        'message': node_data.get('message', ''),
-                        'author': node_data.get('author', ''),
-                        'date': node_data.get('date', datetime.now()).isoformat() 
-                               if isinstance(node_data.get('date'), datetime) else '',
-                        'files_count': node_data.get('files_count', 0),
-                        'is_initial': node_data.get('is_initial', False),
-                        'is_merge': self.graph.in_degree(node) > 1,
-                        'files_changed': node_data.get('files_changed', []),
-                        'analysis': node_data.get('analysis', '')
+                        'message': message,
+                        'author': '' if author is None else author,
+                        'date': date.isoformat() if isinstance(date, datetime) else '',
+                        'files_count': files_count,
+                        'is_initial': is_initial,
+                        'is_merge': in_deg[sha] > 1,
+                        'files_changed': files_changed,
+                        'analysis': analysis
                     }
                 }
-                nodes.append(processed_node)
+                for sha, message, author, date, files_count, is_initial, files_changed, analysis in zip(
+                    table['sha'], table['message'], table['author'], table['date'],
+                    table['files_count'], table['is_initial'], table['files_changed'], table['analysis']
+                )
+            ]
             
             return nodes
 
@@ -160,24 +227,28 @@ class GraphProcessor:
             List[Dict]: Processed edge data
         """
         try:
-            edges = []
-            for source, target in self.graph.edges():
-                # Get positions for source and target nodes
-                source_pos = self.layout[source]
-                target_pos = self.layout[target]
-                
-                # Calculate control point for curved edges
-                control_point = self._calculate_control_point(source_pos, target_pos)
-                
-                edge_data = {
+            in_deg = self._in_deg
+            edge_list = list(self.graph.edges())
+            if not edge_list:
+                return []
+            
+            # Control points for curved edges: midpoints offset along X
+            src_idx = np.fromiter((self._node_idx[s] for s, _ in edge_list), dtype=np.intp, count=len(edge_list))
+            tgt_idx = np.fromiter((self._node_idx[t] for _, t in edge_list), dtype=np.intp, count=len(edge_list))
+            control_points = (self._layout_xyz[src_idx] + self._layout_xyz[tgt_idx]) * 0.5
+            control_points[:, 0] += 20
+            
+            edges = [
+                {
                     'source': source,
                     'target': target,
-                    'controlPoint': control_point,
+                    'controlPoint': {'x': x, 'y': y, 'z': z},
                     'data': {
-                        'is_merge': self.graph.in_degree(target) > 1
+                        'is_merge': in_deg[target] > 1
                     }
                 }
-                edges.append(edge_data)
+                for (source, target), (x, y, z) in zip(edge_list, control_points.tolist())
+            ]
             
             return edges
 
@@ -185,31 +256,6 @@ class GraphProcessor:
             logger.error(f"Error in _process_edges: {str(e)}")
             raise
 
-    def _calculate_control_point(self, source_pos: Dict[str, float], 
-                               target_pos: Dict[str, float]) -> Dict[str, float]:
-        """
-        Calculate a control point for curved edges.
-        
-        Args:
-            source_pos: Source node position
-            target_pos: Target node position
-            
-        Returns:
-            Dict: Control point coordinates
-        """
-        # Calculate midpoint
-        mid_x = (source_pos['x'] + target_pos['x']) / 2
-        mid_y = (source_pos['y'] + target_pos['y']) / 2
-        mid_z = (source_pos['z'] + target_pos['z']) / 2
-        
-        # Add offset for curvature
-        offset = 20
-        return {
-            'x': mid_x + offset,
-            'y': mid_y,
-            'z': mid_z
-        }
-
     def _calculate_metrics(self) -> Dict[str, Any]:
         """
         Calculate various graph metrics.
@@ -229,31 +275,27 @@ class GraphProcessor:
                     'commit_frequency': {}
                 }
 
-            # Calculate basic metrics
+            # Degree-based counts as array scans over the degree views
             total_commits = self.graph.number_of_nodes()
-            merge_commits = sum(1 for n in self.graph.nodes() if self.graph.in_degree(n) > 1)
-            leaf_commits = sum(1 for n in self.graph.nodes() if self.graph.out_degree(n) == 0)
+            shas = list(self._in_deg)
+            in_deg = np.fromiter(self._in_deg.values(), dtype=np.int64, count=total_commits)
+            out_deg = np.fromiter((self._out_deg[n] for n in shas), dtype=np.int64, count=total_commits)
+            merge_commits = int((in_deg > 1).sum())
+            leaf_commits = int((out_deg == 0).sum())
+            roots = [shas[i] for i in np.flatnonzero(in_deg == 0)]
+            
+            # Commit frequency by author from the author column; missing authors count as Unknown
+            commit_frequency = Counter('Unknown' if author is None else author for author in self.commits['author'])
             
             # Calculate max depth
-            roots = [n for n in self.graph.nodes() if self.graph.in_degree(n) == 0]
             max_depth = 0
             for root in roots:
-                try:
-                    depths = nx.shortest_path_length(self.graph, source=root).values()
-                    if depths:
-                        max_depth = max(max_depth, max(depths))
-                except nx.NetworkXError:
-                    continue
+                depths = nx.shortest_path_length(self.graph, source=root)
+                max_depth = max(max_depth, max(depths.values()))
 
             # Calculate average branch length
-            paths = self._calculate_all_branch_paths()
-            avg_branch_length = sum(len(path) for path in paths) / max(len(paths), 1)
-
-            # Calculate commit frequency by author
-            commit_frequency = defaultdict(int)
-            for node in self.graph.nodes():
-                author = self.graph.nodes[node].get('author', 'Unknown')
-                commit_frequency[author] += 1
+            total_paths, total_length = self._calculate_branch_path_totals()
+            avg_branch_length = total_length / max(total_paths, 1)
 
             return {
                 'total_commits': total_commits,
@@ -269,28 +311,32 @@ class GraphProcessor:
             logger.error(f"Error in _calculate_metrics: {str(e)}")
             raise
 
-    def _calculate_all_branch_paths(self) -> List[List[str]]:
+    def _calculate_branch_path_totals(self) -> Tuple[int, int]:
         """
-        Calculate all unique paths from root to leaf nodes.
+        Count root-to-leaf paths and their total length without enumerating them.
         
         Returns:
-            List[List[str]]: List of paths
+            Tuple[int, int]: Number of paths and the sum of their lengths in nodes
         """
         try:
-            roots = [n for n in self.graph.nodes() if self.graph.in_degree(n) == 0]
-            leaves = [n for n in self.graph.nodes() if self.graph.out_degree(n) == 0]
-            
-            all_paths = []
-            for root in roots:
-                for leaf in leaves:
-                    try:
-                        paths = list(nx.all_simple_paths(self.graph, root, leaf))
-                        all_paths.extend(paths)
-                    except nx.NetworkXNoPath:
-                        continue
+            # Per node: number of root->node paths and the sum of their edge lengths
+            counts = {}
+            length_sums = {}
+            for node in nx.topological_sort(self.graph):
+                preds = list(self.graph.predecessors(node))
+                if not preds:
+                    counts[node] = 1
+                    length_sums[node] = 0
+                else:
+                    counts[node] = sum(counts[p] for p in preds)
+                    length_sums[node] = sum(length_sums[p] + counts[p] for p in preds)
+
+            leaves = [n for n, degree in self._out_deg.items() if degree == 0]
+            total_paths = sum(counts[leaf] for leaf in leaves)
+            total_length = sum(length_sums[leaf] + counts[leaf] for leaf in leaves)
             
-            return all_paths
+            return total_paths, total_length
 
         except Exception as e:
-            logger.error(f"Error in _calculate_all_branch_paths: {str(e)}")
-            return []
\ No newline at end of file
+            logger.error(f"Error in _calculate_branch_path_totals: {str(e)}")
+            return 0, 0
@@ -3,9 +3,141 @@ from datetime import datetime
 import aiohttp
 import asyncio
 from dataclasses import dataclass
-from typing import List, Dict, Optional, Tuple
-import json
+from typing import BinaryIO, List, Dict, Optional, Tuple
 import os
+import orjson
+import re
+from collections import Counter, OrderedDict
+from contextlib import asynccontextmanager
+from .graph_processor import COMMIT_COLUMNS
+
+try:
+    from ciso8601 import parse_datetime as _parse_datetime
+except ImportError:
+    def _parse_datetime(value: str) -> datetime:
+        """Parses a GitHub ISO 8601 timestamp"""
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+# Number of commits summarized per OpenAI request
+ANALYSIS_BATCH_SIZE = 8
+
+# Characters of the first file's patch kept as a commit's code sample
+CODE_SAMPLE_SIZE = 500
+
+# Characters of patch text sent per commit, split across its files
+PATCH_BUDGET = 3000
+
+# Retry policy for rate-limited or failing HTTP requests
+MAX_RETRIES = 3
+MAX_RETRY_DELAY = 60
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Commit detail responses revalidated with ETags, shared by all analyzers in the
+# process: url -> (etag, {'files': [{'filename', 'patch', 'changes'}]}), least recently used first
+ETAG_CACHE_PATH = os.path.join('commit_summaries', '.etag_cache.json')
+ETAG_CACHE_SIZE = 2048
+_etag_cache: "OrderedDict[str, Tuple[str, Dict]]" = OrderedDict()
+_etag_cache_loaded = False
+# Whether entries were added since the cache was last persisted
+_etag_cache_dirty = False
+_etag_cache_lock = asyncio.Lock()
+
+def _read_etag_cache_file() -> List:
+    """Reads the persisted ETag cache entries as [url, etag, data] triples"""
+    try:
+        with open(ETAG_CACHE_PATH, 'rb') as f:
+            entries = orjson.loads(f.read())
+        return [(url, etag, data) for url, etag, data in entries]
+    except (OSError, ValueError, TypeError):
+        return []
+
+def _write_etag_cache_file(entries: List):
+    """Atomically replaces the persisted ETag cache so concurrent workers never see a partial file"""
+    os.makedirs(os.path.dirname(ETAG_CACHE_PATH), exist_ok=True)
+    tmp_path = f"{ETAG_CACHE_PATH}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(orjson.dumps(entries))
+    os.replace(tmp_path, ETAG_CACHE_PATH)
+
+async def _ensure_etag_cache():
+    """Loads the persisted ETag cache once per process, off the event loop"""
+    global _etag_cache_loaded
+    async with _etag_cache_lock:
+        if _etag_cache_loaded:
+            return
+        for url, etag, data in await asyncio.to_thread(_read_etag_cache_file):
+            files = data.get('files', [])
+            # Entries written before patches were trimmed still hold the full patch
+            if any('changes' not in f for f in files):
+                data = {'files': _slim_files(files)}
+            _etag_cache.setdefault(url, (etag, data))
+        while len(_etag_cache) > ETAG_CACHE_SIZE:
+            _etag_cache.popitem(last=False)
+        _etag_cache_loaded = True
+
+async def _save_etag_cache():
+    """Persists a snapshot of the ETag cache from a worker thread when entries were added"""
+    global _etag_cache_dirty
+    if not _etag_cache_dirty:
+        return
+    _etag_cache_dirty = False
+    entries = [(url, etag, data) for url, (etag, data) in _etag_cache.items()]
+    await asyncio.to_thread(_write_etag_cache_file, entries)
+
+async def _read_json(response: aiohttp.ClientResponse):
+    """Decodes a response body with orjson instead of the stdlib json module"""
+    return orjson.loads(await response.read())
+
+def _should_retry(response: aiohttp.ClientResponse) -> bool:
+    """Checks whether a response is a transient failure worth retrying"""
+    if response.status in RETRY_STATUSES:
+        return True
+    # GitHub signals primary and secondary rate limits with 403
+    return response.status == 403 and (
+        'Retry-After' in response.headers or response.headers.get('X-RateLimit-Remaining') == '0'
+    )
+
+def _retry_delay(response: aiohttp.ClientResponse, attempt: int) -> float:
+    """Seconds to wait before retrying, honoring Retry-After when present"""
+    retry_after = response.headers.get('Retry-After')
+    if retry_after and retry_after.isdigit():
+        return min(float(retry_after), MAX_RETRY_DELAY)
+    return min(2 ** attempt, MAX_RETRY_DELAY)
+
+@asynccontextmanager
+async def _request(session: aiohttp.ClientSession, method: str, url: str, **kwargs):
+    """Issues a request, retrying with exponential backoff on rate limits and 5xx"""
+    for attempt in range(MAX_RETRIES + 1):
+        response = await session.request(method, url, **kwargs)
+        if attempt == MAX_RETRIES or not _should_retry(response):
+            break
+        delay = _retry_delay(response, attempt)
+        response.release()
+        await asyncio.sleep(delay)
+    try:
+        yield response
+    finally:
+        response.release()
+
+def _compact_patch(patch: str, limit: int) -> str:
+    """Keeps only added/removed lines of a patch with whitespace collapsed"""
+    changed = "\n".join(
+        line for line in patch.splitlines()
+        if line.startswith(('+', '-')) and not line.startswith(('+++', '---'))
+    )
+    return re.sub(r'[ \t]+', ' ', changed)[:limit]
+
+def _slim_files(files: List[Dict]) -> List[Dict]:
+    """Keeps only what analysis reads of each changed file: its name, code sample and compacted patch"""
+    per_file = PATCH_BUDGET // max(len(files), 1)
+    return [
+        {
+            'filename': f['filename'],
+            'patch': f['patch'][:CODE_SAMPLE_SIZE] if f.get('patch') else None,
+            'changes': _compact_patch(f['patch'], per_file) if f.get('patch') else None
+        }
+        for f in files
+    ]
 
 @dataclass
 class CommitNode:
@@ -30,81 +162,126 @@ class RepositoryAnalyzer:
             'Accept': 'application/vnd.github+json'
         }
         self.commit_graph = nx.DiGraph()
-        self.commit_summaries = []
+        # Temporary file commit summaries are written to, one JSON line per analyzed commit
+        self._summary_fp: Optional[BinaryIO] = None
+        # Per-commit attributes stored column-wise; the graph keeps only topology
+        self.commits: Dict[str, List] = {}
+        self._sha_idx: Dict[str, int] = {}
+        # Bound concurrent GitHub requests
+        self._sem = asyncio.Semaphore(16)
+
+    async def _fetch_commit_detail(self, session: aiohttp.ClientSession, url: str) -> Optional[Dict]:
+        """Fetches a commit's details, revalidating any cached copy with its ETag"""
+        global _etag_cache_dirty
+        headers = self.headers
+        cached = _etag_cache.get(url)
+        if cached:
+            _etag_cache.move_to_end(url)
+            headers = {**self.headers, 'If-None-Match': cached[0]}
+        
+        async with self._sem:
+            async with _request(session, 'GET', url, headers=headers) as response:
+                if response.status == 304 and cached:
+                    return cached[1]
+                if response.status != 200:
+                    return None
+                # Keep only the fields analysis reads, whether fresh or cached
+                data = {'files': _slim_files((await _read_json(response)).get('files', []))}
+                etag = response.headers.get('ETag')
+                if etag:
+                    _etag_cache[url] = (etag, data)
+                    _etag_cache.move_to_end(url)
+                    _etag_cache_dirty = True
+                    if len(_etag_cache) > ETAG_CACHE_SIZE:
+                        _etag_cache.popitem(last=False)
+                return data
 
     async def _fetch_commits(self, session: aiohttp.ClientSession, owner: str, repo: str, limit: int) -> List[Dict]:
         """Fetches commit history from GitHub API"""
         url = f'https://api.github.com/repos/{owner}/{repo}/commits?per_page={limit}'
-        async with session.get(url, headers=self.headers) as response:
+        async with _request(session, 'GET', url, headers=self.headers) as response:
             if response.status != 200:
                 error_data = await response.text()
                 raise Exception(f'Failed to fetch commits: {error_data}')
-            return await response.json()
+            return await _read_json(response)
 
-    def _save_commit_summaries(self, repo_name: str, author_name: str):
-        """Saves commit summaries to a JSON file"""
-        filename = f"{repo_name}_{author_name}.json"
-        
-        # Convert datetime objects to ISO format strings for JSON serialization
-        summaries = self.commit_summaries.copy()
+    def _open_commit_summaries(self, repo_name: str, author_name: str) -> Tuple[BinaryIO, str]:
+        """
+        Opens a temporary NDJSON file for commit summaries, returned with the path
+        it should replace once the analysis succeeds
+        """
+        filename = f"{repo_name}_{author_name}.jsonl"
         
         # Ensure the summaries directory exists
         os.makedirs('commit_summaries', exist_ok=True)
         filepath = os.path.join('commit_summaries', filename)
         
-        with open(filepath, 'w') as f:
-            json.dump(summaries, f, indent=2)
-        
-        print(f"Saved commit summaries to {filepath}")
+        return open(f"{filepath}.{os.getpid()}.{id(self)}.tmp", 'wb'), filepath
 
     async def analyze_repository(self, owner: str, repo: str, limit: int = 50) -> Tuple[nx.DiGraph, List[Dict]]:
         """
         Analyzes a repository and returns both the graph and commit summaries.
         """
         try:
-            async with aiohttp.ClientSession() as session:
+            connector = aiohttp.TCPConnector(limit_per_host=8, keepalive_timeout=60)
+            async with aiohttp.ClientSession(connector=connector) as session:
                 # Reset data structures
                 self.commit_graph = nx.DiGraph()
-                self.commit_summaries = []
+                self.commits = {}
+                self._sha_idx = {}
                 
                 # Fetch commits
+                await _ensure_etag_cache()
                 commits = await self._fetch_commits(session, owner, repo, limit)
                 
                 if not commits:
                     print(f"No commits found for repository {owner}/{repo}")
                     return self.commit_graph, []
                 
-                # Build initial graph structure
-                for commit in commits:
-                    sha = commit['sha']
-                    parent_shas = [p['sha'] for p in commit['parents']]
-                    
-                    # Add nodes and edges
-                    self.commit_graph.add_node(sha, 
-                        message=commit['commit']['message'],
-                        author=commit['commit']['author']['name'],
-                        date=datetime.fromisoformat(commit['commit']['author']['date'].replace('Z', '+00:00')),
-                        is_initial=len(parent_shas) == 0
-                    )
-                    
-                    # Add edges from parents to this commit
-                    for parent_sha in parent_shas:
-                        if parent_sha in [c['sha'] for c in commits]:
-                            self.commit_graph.add_edge(parent_sha, sha)
+                # Build the commit table column by column
+                shas = [c['sha'] for c in commits]
+                n = len(shas)
+                self._sha_idx = {sha: row for row, sha in enumerate(shas)}
+                self.commits = {
+                    'sha': shas,
+                    'message': [c['commit']['message'] for c in commits],
+                    'author': [c['commit']['author']['name'] for c in commits],
+                    'date': [_parse_datetime(c['commit']['author']['date']) for c in commits],
+                    'files_count': [COMMIT_COLUMNS['files_count']] * n,
+                    'is_initial': [not c['parents'] for c in commits],
+                    'files_changed': [[] for _ in range(n)],
+                    'analysis': [COMMIT_COLUMNS['analysis']] * n,
+                    'code': [COMMIT_COLUMNS['code']] * n
+                }
+                self.commit_graph.graph['commits'] = self.commits
+                self.commit_graph.graph['sha_idx'] = self._sha_idx
+                
+                # Build the graph topology in bulk, keeping only parents that were fetched
+                self.commit_graph.add_nodes_from(shas)
+                self.commit_graph.add_edges_from(
+                    (p['sha'], c['sha']) for c in commits for p in c['parents'] if p['sha'] in self._sha_idx
+                )
                 
-                # Analyze commits and update both graph and summaries
-                await self._analyze_commits(session, commits)
+                # Use the most frequent author as the summaries filename author
+                author_counts = Counter(c['commit']['author']['name'] for c in commits)
+                main_author = author_counts.most_common(1)[0][0]
                 
-                # Save commit summaries to JSON file
-                if commits and len(commits) > 0:
-                    repo_name = repo
-                    # Use the most frequent author as the filename author
-                    author_counts = {}
-                    for commit in commits:
-                        author = commit['commit']['author']['name']
-                        author_counts[author] = author_counts.get(author, 0) + 1
-                    main_author = max(author_counts.items(), key=lambda x: x[1])[0]
-                    self._save_commit_summaries(repo_name, main_author)
+                # Analyze commits; the summaries replace the previous file only on success
+                self._summary_fp, summary_path = self._open_commit_summaries(repo, main_author)
+                tmp_path = self._summary_fp.name
+                try:
+                    await self._analyze_commits(session, commits)
+                except BaseException:
+                    self._summary_fp.close()
+                    os.remove(tmp_path)
+                    raise
+                else:
+                    self._summary_fp.close()
+                    os.replace(tmp_path, summary_path)
+                    print(f"Saved commit summaries to {summary_path}")
+                finally:
+                    self._summary_fp = None
+                await _save_etag_cache()
                 
                 return self.commit_graph
                 
@@ -112,77 +289,97 @@ class RepositoryAnalyzer:
             print(f"Error analyzing repository: {str(e)}")
             return nx.DiGraph()
 
-    async def _fetch_commit_code(self, session: aiohttp.ClientSession, url: str) -> str:
-        """Fetches the code content for a commit"""
-        async with session.get(url, headers=self.headers) as response:
-            if response.status != 200:
-                return "No code available"
-            data = await response.json()
-            if data.get('files'):
-                return data['files'][0].get('patch', "No code changes available")[:500]
-            return "No code changes available"
-
     async def _analyze_commits(self, session: aiohttp.ClientSession, commits: List[Dict]):
-        """Analyzes commits in parallel using asyncio"""
-        tasks = [self._analyze_single_commit(session, commit) for commit in commits]
-        await asyncio.gather(*tasks)
+        """Fetches commit details in parallel and analyzes them in batches"""
+        async with asyncio.TaskGroup() as tg:
+            detail_tasks = [tg.create_task(self._fetch_commit_detail(session, c['url'])) for c in commits]
+        details = [task.result() for task in detail_tasks]
+        fetched = [(commit, data.get('files', [])) for commit, data in zip(commits, details) if data is not None]
+        
+        # Only commits with file changes need AI analysis
+        to_analyze = [(commit, files) for commit, files in fetched if files]
+        groups = [to_analyze[i:i + ANALYSIS_BATCH_SIZE] for i in range(0, len(to_analyze), ANALYSIS_BATCH_SIZE)]
+        async with asyncio.TaskGroup() as tg:
+            batch_tasks = [
+                tg.create_task(self._analyze_with_gpt4_batch(session, [files for _, files in group]))
+                for group in groups
+            ]
+        results = [task.result() for task in batch_tasks]
+        analyses = {
+            commit['sha']: analysis
+            for group, group_results in zip(groups, results)
+            for (commit, _), analysis in zip(group, group_results)
+        }
+        
+        for commit, files in fetched:
+            self._record_commit_analysis(commit, files, analyses.get(commit['sha'], "No changes"))
 
-    async def _analyze_single_commit(self, session: aiohttp.ClientSession, commit: Dict):
-        """Analyzes a single commit's changes and updates both graph and summaries"""
+    def _record_commit_analysis(self, commit: Dict, files: List[Dict], analysis: str):
+        """Updates the commit table and summaries file with a single commit's changes"""
         sha = commit['sha']
-        url = commit['url']
         
-        async with session.get(url, headers=self.headers) as response:
-            if response.status != 200:
-                return
-            
-            commit_data = await response.json()
-            files = commit_data.get('files', [])
-            
-            # Get code sample
-            code_sample = await self._fetch_commit_code(session, url)
-            
-            # Get AI analysis
-            analysis = await self._analyze_with_gpt4(files) if files else "No changes"
-            
-            # Update graph node
-            self.commit_graph.nodes[sha].update({
-                'files_changed': [f['filename'] for f in files],
-                'files_count': len(files),
-                'analysis': analysis,
-                'code': code_sample
-            })
-            
-            # Add to commit summaries
-            commit_summary = {
-                "author": commit['commit']['author']['name'],
-                "code": code_sample,
-                "explanation": analysis,
-                "sha": sha,
-                "files edited": len(files)
-            }
-            self.commit_summaries.append(commit_summary)
+        # Get code sample from the first changed file
+        code_sample = (files[0].get('patch') or "No code changes available")[:CODE_SAMPLE_SIZE] if files else "No code changes available"
+        
+        # Update the commit's row
+        row = self._sha_idx[sha]
+        self.commits['files_changed'][row] = [f['filename'] for f in files]
+        self.commits['files_count'][row] = len(files)
+        self.commits['analysis'][row] = analysis
+        self.commits['code'][row] = code_sample
+        
+        # Append to the commit summaries file
+        commit_summary = {
+            "author": commit['commit']['author']['name'],
+            "code": code_sample,
+            "explanation": analysis,
+            "sha": sha,
+            "files edited": len(files)
+        }
+        if self._summary_fp is not None:
+            self._summary_fp.write(orjson.dumps(commit_summary) + b'\n')
 
-    async def _analyze_with_gpt4(self, files: List[Dict]) -> str:
-        """Analyzes file changes using GPT-4"""
-        patches = [f.get('patch', 'No changes available')[:1000] for f in files]
-        prompt = f"Analyze this code change briefly:\nFiles modified: {', '.join(f['filename'] for f in files)}\nChanges: {' '.join(patches)}\nProvide a concise summary."
+    async def _analyze_with_gpt4_batch(self, session: aiohttp.ClientSession, batch: List[List[Dict]]) -> List[str]:
+        """Analyzes several commits' file changes with a single GPT-4 request"""
+        sections = []
+        for index, files in enumerate(batch, start=1):
+            patches = [f['changes'] if f.get('patch') else 'No changes available' for f in files]
+            sections.append(
+                f"Commit {index}:\nFiles modified: {', '.join(f['filename'] for f in files)}\nChanges: {' '.join(patches)}"
+            )
+        prompt = (
+            f"Analyze these {len(batch)} code changes briefly. "
+            f"Return a JSON object with key 'summaries' holding an array of {len(batch)} objects, "
+            f"one per commit in order, each with key 'summary' containing a concise summary.\n\n"
+            + "\n\n".join(sections)
+        )
+        failed = ["Analysis failed"] * len(batch)
         
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                'https://api.openai.com/v1/chat/completions',
-                headers={
-                    'Authorization': f'Bearer {self.openai_key}',
-                    'Content-Type': 'application/json'
-                },
-                json={
-                    'model': 'gpt-4',
-                    'messages': [{'role': 'user', 'content': prompt}],
-                    'temperature': 0.7,
-                    'max_tokens': 100
-                }
-            ) as response:
-                if response.status != 200:
-                    return "Analysis failed"
-                result = await response.json()
-                return result['choices'][0]['message']['content']
\ No newline at end of file
+        async with _request(
+            session,
+            'POST',
+            'https://api.openai.com/v1/chat/completions',
+            headers={
+                'Authorization': f'Bearer {self.openai_key}',
+                'Content-Type': 'application/json'
+            },
+            json={
+                'model': 'gpt-4o-mini',
+                'messages': [{'role': 'user', 'content': prompt}],
+                'response_format': {'type': 'json_object'},
+                'temperature': 0.7,
+                'max_tokens': 100 * len(batch)
+            }
+        ) as response:
+            if response.status != 200:
+                return failed
+            result = await _read_json(response)
+        
+        try:
+            content = orjson.loads(result['choices'][0]['message']['content'])
+            summaries = [item.get('summary', "Analysis failed") for item in content['summaries']]
+        except (KeyError, IndexError, TypeError, AttributeError, ValueError):
+            return failed
+        
+        # Pad or trim so every commit in the batch gets an entry
+        return (summaries + failed)[:len(batch)]
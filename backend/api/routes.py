@@ -1,45 +1,82 @@
-from fastapi import APIRouter, HTTPException
-from typing import Dict, Optional
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from typing import Dict, List, Optional, Tuple
 import os
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
+from analyzer import DEFAULT_COMMIT_LIMIT, MAX_COMMIT_LIMIT
 from analyzer.repo_analyzer import RepositoryAnalyzer
 from analyzer.graph_processor import GraphProcessor
-from dotenv import load_dotenv
-import traceback
 import logging
-from fastapi.security import APIKeyHeader
-from fastapi import Security, Depends
-import aiohttp
+from cachetools import LRUCache, TTLCache
+import asyncio
+from functools import partial
+import orjson
+import re
+import hmac
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Load environment variables
-load_dotenv()
+# Configuration resolved once at import rather than per request
+_API_KEY = os.getenv("API_KEY")
+_GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")
+_OPENAI_KEY = os.getenv("OPENAI_API_KEY")
+_GITHUB_HEADERS = {
+    'Authorization': f'Bearer {_GITHUB_TOKEN}',
+    'Accept': 'application/vnd.github+json'
+}
+_GITHUB_DIFF_HEADERS = {
+    'Authorization': f'Bearer {_GITHUB_TOKEN}',
+    'Accept': 'application/vnd.github.v3.diff'
+}
 
 # Create router
 router = APIRouter()
 
+# Parsed commit diffs keyed by (owner, repo, commit) -> (etag, {file: raw diff bytes}, complete).
+# Entries are partial when reading stopped early at the requested file.
+_diff_cache: LRUCache = LRUCache(maxsize=512)
+
+# Validated analyze results keyed by (owner, repo, limit), kept for 15 minutes
+_analysis_cache: TTLCache = TTLCache(maxsize=64, ttl=900)
+_inflight: Dict[Tuple[str, str, int], "asyncio.Task[AnalysisResult]"] = {}
+
+# Streamed analyze results: items per nodes/edges event, seconds between keepalives
+_STREAM_BATCH_SIZE = 500
+_STREAM_KEEPALIVE = 15
+
+# Chunk size for streaming diffs from GitHub
+_DIFF_CHUNK_SIZE = 65536
+_DIFF_HEADER = b'\ndiff --git'
+
+
+# One file section of a git diff: from its "diff --git a/... b/<file>" header
+# up to the next header or the end of the diff
+_DIFF_RE = re.compile(rb'^diff --git [^\n]* b/(?P<file>[^\n]*).*?(?=\ndiff --git|\Z)', re.S | re.M)
+
+# Full commit SHAs name immutable diffs; other refs may move
+_SHA_RE = re.compile(r'^[0-9a-f]{40}$')
+
 # Security
 API_KEY_NAME = "X-API-Key"
-api_key_header = APIKeyHeader(name=API_KEY_NAME, auto_error=False)
+_API_KEY_BYTES = _API_KEY.encode() if _API_KEY else None
 
-async def verify_api_key(api_key: str = Security(api_key_header)):
-    """Verify API key if one is set in environment"""
-    expected_key = os.getenv("API_KEY")
-    if expected_key:
-        if not api_key or api_key != expected_key:
-            raise HTTPException(
-                status_code=403,
-                detail="Invalid API key"
-            )
-    return api_key
+async def api_key_middleware(request: Request, call_next):
+    """Verify the API key on API routes once, before routing, if one is set in environment"""
+    if (
+        _API_KEY_BYTES
+        and request.method != "OPTIONS"
+        and request.url.path.startswith("/api/")
+        and not hmac.compare_digest(request.headers.get(API_KEY_NAME, "").encode(), _API_KEY_BYTES)
+    ):
+        return JSONResponse(status_code=403, content={"detail": "Invalid API key"})
+    return await call_next(request)
 
 class RepositoryRequest(BaseModel):
-    owner: str
-    repo: str
-    limit: Optional[int] = 50
+    owner: str = Field(..., pattern=r'^[A-Za-z0-9-]+$')
+    repo: str = Field(..., pattern=r'^[A-Za-z0-9._-]+$')
+    limit: int = Field(DEFAULT_COMMIT_LIMIT, ge=1, le=MAX_COMMIT_LIMIT)
 
 class DiffRequest(BaseModel):
     owner: str
@@ -47,209 +84,348 @@ class DiffRequest(BaseModel):
     commit: str
     file: str
 
+class DiffResponse(BaseModel):
+    content: str
+
 class OpenAIKeyResponse(BaseModel):
     key: str
 
+class Point(BaseModel):
+    x: float
+    y: float
+    z: float
+
+class NodeData(BaseModel):
+    message: str
+    author: str
+    date: str
+    files_count: int
+    is_initial: bool
+    is_merge: bool
+    files_changed: List[str]
+    analysis: str
+
+class NodeModel(BaseModel):
+    id: str
+    position: Point
+    data: NodeData
+
+class EdgeData(BaseModel):
+    is_merge: bool
+
+class EdgeModel(BaseModel):
+    source: str
+    target: str
+    controlPoint: Point
+    data: EdgeData
+
+class MetricsModel(BaseModel):
+    total_commits: int
+    max_depth: int
+    branching_factor: float
+    leaf_commits: int
+    merge_commits: int
+    average_branch_length: float
+    commit_frequency: Dict[str, int]
+
+class VisualizationData(BaseModel):
+    nodes: List[NodeModel] = Field(..., min_length=1)
+    edges: List[EdgeModel] = Field(..., min_length=1)
+    metrics: MetricsModel
+
+# Serializers for the nodes/edges batches of the event stream
+_NODE_BATCH = TypeAdapter(List[NodeModel])
+_EDGE_BATCH = TypeAdapter(List[EdgeModel])
+
+class AnalysisResult:
+    """A validated analyze result whose response bodies are serialized on first use"""
+    __slots__ = ('data', '_json_body', '_stream_body')
+
+    def __init__(self, data: VisualizationData):
+        self.data = data
+        self._json_body: Optional[bytes] = None
+        self._stream_body: Optional[bytes] = None
+
+    def json_body(self) -> bytes:
+        """The /api/v1/analyze response body"""
+        if self._json_body is None:
+            self._json_body = self.data.model_dump_json().encode()
+        return self._json_body
+
+    def stream_body(self) -> bytes:
+        """The nodes, edges, metrics and done events of the /api/v1/analyze/stream response"""
+        if self._stream_body is None:
+            self._stream_body = _serialize_stream(self.data)
+        return self._stream_body
+
 @router.get("/api/v1/config/openai-key", response_model=OpenAIKeyResponse)
-async def get_openai_key(api_key: str = Depends(verify_api_key)):
+async def get_openai_key(response: Response):
     """
     Returns a configured OpenAI key for frontend use.
-    Requires API key authentication if configured.
+    Requires API key authentication if configured (see api_key_middleware).
     """
-    try:
-        openai_key = os.getenv("OPENAI_API_KEY")
-        if not openai_key:
-            raise HTTPException(
-                status_code=500,
-                detail="OpenAI API key not configured on server"
-            )
-        
-        return OpenAIKeyResponse(key=openai_key)
-    
-    except HTTPException as he:
-        raise he
-    except Exception as e:
-        logger.error(f"Error fetching OpenAI key: {str(e)}")
+    if not _OPENAI_KEY:
         raise HTTPException(
             status_code=500,
-            detail="Failed to retrieve OpenAI key"
+            detail="OpenAI API key not configured on server"
         )
 
-@router.post("/api/v1/analyze")
+    # The key is fixed for the process lifetime; let the browser keep it
+    response.headers['Cache-Control'] = 'private, max-age=3600'
+    return OpenAIKeyResponse(key=_OPENAI_KEY)
+
+@router.post("/api/v1/analyze", response_model=VisualizationData)
 async def analyze_repository(
     request: RepositoryRequest,
-    api_key: str = Depends(verify_api_key)
+    fastapi_request: Request
 ):
     """
     Analyzes a GitHub repository and returns the processed data
     for visualization
     """
-    try:
-        # Get tokens from environment variables
-        github_token = os.getenv("GITHUB_TOKEN")
-        openai_key = os.getenv("OPENAI_API_KEY")
+    if not _GITHUB_TOKEN or not _OPENAI_KEY:
+        logger.error("Missing API keys in server configuration")
+        raise HTTPException(
+            status_code=500,
+            detail="Missing API keys in server configuration"
+        )
 
-        if not github_token or not openai_key:
-            logger.error("Missing API keys in server configuration")
-            raise HTTPException(
-                status_code=500,
-                detail="Missing API keys in server configuration"
-            )
+    result = await _cached_analysis(request, fastapi_request)
+    return Response(content=result.json_body(), media_type='application/json')
+
+async def _cached_analysis(request: RepositoryRequest, fastapi_request: Request) -> AnalysisResult:
+    """Return the analysis for a repository, from the cache when possible"""
+    # Serve repeat requests from the cache of analyze results
+    cache_key = (request.owner, request.repo, request.limit)
+    cached = _analysis_cache.get(cache_key)
+    if cached is not None:
+        logger.info("Serving cached analysis for %s/%s", request.owner, request.repo)
+        return cached
 
-        # Initialize analyzer
-        analyzer = RepositoryAnalyzer(
-            github_token=github_token,
-            openai_key=openai_key
+    # Concurrent requests for the same repository share one in-flight analysis.
+    # It runs as its own task, so no caller's cancellation cancels it for the others
+    task = _inflight.get(cache_key)
+    if task is None:
+        task = asyncio.create_task(_run_analysis(request, fastapi_request))
+        _inflight[cache_key] = task
+        task.add_done_callback(partial(_finish_analysis, cache_key))
+    return await asyncio.shield(task)
+
+def _finish_analysis(cache_key: Tuple[str, str, int], task: asyncio.Task):
+    """Cache a finished analysis and retire its in-flight entry"""
+    del _inflight[cache_key]
+    # Checking the exception also marks it retrieved when no caller is left waiting
+    if not task.cancelled() and task.exception() is None:
+        _analysis_cache[cache_key] = task.result()
+
+@router.post("/api/v1/analyze/stream")
+async def stream_repository_analysis(
+    request: RepositoryRequest,
+    fastapi_request: Request
+):
+    """
+    Analyzes a GitHub repository and streams the visualization data
+    as Server-Sent Events: progress, then nodes and edges in batches,
+    then metrics and done. Failures are reported as an error event.
+    """
+    if not _GITHUB_TOKEN or not _OPENAI_KEY:
+        logger.error("Missing API keys in server configuration")
+        raise HTTPException(
+            status_code=500,
+            detail="Missing API keys in server configuration"
         )
 
-        # Analyze repository
-        logger.info(f"Analyzing repository: {request.owner}/{request.repo}")
+    async def events():
+        yield _sse_event('progress', orjson.dumps({'status': 'Analyzing repository...'}))
+
+        # Keep the connection alive while the analysis runs. If the client goes away
+        # only this wait is cancelled; the shared analysis still finishes and is cached
+        analysis = asyncio.ensure_future(_cached_analysis(request, fastapi_request))
         try:
-            graph = await analyzer.analyze_repository(
-                request.owner,
-                request.repo,
-                request.limit
-            )
-            
-            if not graph or graph.number_of_nodes() == 0:
-                logger.error("No nodes found in analyzed repository")
-                raise HTTPException(
-                    status_code=404,
-                    detail="No commits found in repository"
-                )
-            
-            logger.info(f"Graph created with {graph.number_of_nodes()} nodes")
-            
-            # Process graph for visualization
-            processor = GraphProcessor(graph)
-            visualization_data = processor.process_for_visualization()
-            
-            # Add OpenAI key to visualization data
-            visualization_data['config'] = {
-                'openai_key': openai_key
-            }
-            
-            # Validate visualization data
-            if not visualization_data.get('nodes') or not visualization_data.get('edges'):
-                logger.error("Invalid visualization data structure")
-                raise HTTPException(
-                    status_code=500,
-                    detail="Failed to process repository data"
-                )
-            
-            logger.info(f"Processed {len(visualization_data['nodes'])} nodes and {len(visualization_data['edges'])} edges")
-            logger.info(f"Sample node data: {visualization_data['nodes'][0] if visualization_data['nodes'] else 'No nodes'}")
-            
-            return visualization_data
-            
-        except Exception as e:
-            logger.error(f"Error during analysis: {str(e)}")
-            logger.error(f"Traceback: {traceback.format_exc()}")
+            while not analysis.done():
+                done, _ = await asyncio.wait({analysis}, timeout=_STREAM_KEEPALIVE)
+                if not done:
+                    yield b': keepalive\n\n'
+        finally:
+            analysis.cancel()
+
+        try:
+            stream_body = analysis.result().stream_body()
+        except asyncio.CancelledError:
+            yield _sse_event('error', orjson.dumps({'status': 503, 'detail': "Analysis cancelled"}))
+            return
+        except HTTPException as he:
+            yield _sse_event('error', orjson.dumps({'status': he.status_code, 'detail': he.detail}))
+            return
+        except Exception:
+            logger.exception("Error during streamed analysis")
+            yield _sse_event('error', orjson.dumps({'status': 500, 'detail': "Analysis failed"}))
+            return
+
+        # The batched events are serialized once per cached analysis
+        yield stream_body
+
+    return StreamingResponse(
+        events(),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def _sse_event(event: str, data: bytes) -> bytes:
+    """Format a Server-Sent Event with a serialized JSON payload"""
+    return b'event: ' + event.encode() + b'\ndata: ' + data + b'\n\n'
+
+def _serialize_stream(visualization_data: VisualizationData) -> bytes:
+    """Serialize the nodes, edges, metrics and done events of the analyze stream"""
+    events = []
+    for kind, items, adapter in (
+        ('nodes', visualization_data.nodes, _NODE_BATCH),
+        ('edges', visualization_data.edges, _EDGE_BATCH)
+    ):
+        for i in range(0, len(items), _STREAM_BATCH_SIZE):
+            events.append(_sse_event(kind, adapter.dump_json(items[i:i + _STREAM_BATCH_SIZE])))
+    events.append(_sse_event('metrics', visualization_data.metrics.model_dump_json().encode()))
+    events.append(_sse_event('done', orjson.dumps({
+        'nodes': len(visualization_data.nodes),
+        'edges': len(visualization_data.edges)
+    })))
+    return b''.join(events)
+
+async def _run_analysis(request: RepositoryRequest, fastapi_request: Request) -> AnalysisResult:
+    """Run the full analysis for a repository and return its validated result"""
+    # Cheap existence check before building any analyzer state
+    session = fastapi_request.app.state.http_session
+    repo_url = f'https://api.github.com/repos/{request.owner}/{request.repo}'
+    async with session.head(repo_url, headers=_GITHUB_HEADERS) as response:
+        if response.status == 404:
             raise HTTPException(
-                status_code=500,
-                detail=f"Analysis failed: {str(e)}"
+                status_code=404,
+                detail="Repository not found"
             )
-            
-    except HTTPException as he:
-        raise he
-    except Exception as e:
-        logger.error(f"Unexpected error: {str(e)}")
-        logger.error(f"Traceback: {traceback.format_exc()}")
+
+    # Initialize analyzer
+    analyzer = RepositoryAnalyzer(
+        github_token=_GITHUB_TOKEN,
+        openai_key=_OPENAI_KEY
+    )
+
+    # Analyze repository
+    logger.info("Analyzing repository: %s/%s", request.owner, request.repo)
+    graph = await analyzer.analyze_repository(
+        request.owner,
+        request.repo,
+        request.limit
+    )
+
+    if not graph or graph.number_of_nodes() == 0:
+        logger.error("No nodes found in analyzed repository")
+        raise HTTPException(
+            status_code=404,
+            detail="No commits found in repository"
+        )
+
+    logger.info("Graph created with %d nodes", graph.number_of_nodes())
+
+    # Process graph for visualization
+    processor = GraphProcessor(graph)
+
+    # Validate visualization data once per analysis; the cached result is reused as-is
+    try:
+        visualization_data = VisualizationData.model_validate(processor.process_for_visualization())
+    except ValidationError as e:
+        logger.error("Invalid visualization data structure: %s", e)
         raise HTTPException(
             status_code=500,
-            detail=f"Server error: {str(e)}"
+            detail="Failed to process repository data"
         )
 
-@router.post("/api/v1/diff")
+    logger.info("Processed %d nodes and %d edges", len(visualization_data.nodes), len(visualization_data.edges))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Sample node data: %s", visualization_data.nodes[0])
+
+    return AnalysisResult(visualization_data)
+
+@router.post("/api/v1/diff", response_model=DiffResponse)
 async def get_file_diff(
     request: DiffRequest,
-    api_key: str = Depends(verify_api_key)
+    fastapi_request: Request
 ):
     """
     Retrieves the diff content for a specific file in a commit
     """
-    try:
-        github_token = os.getenv("GITHUB_TOKEN")
-        if not github_token:
-            raise HTTPException(
-                status_code=500,
-                detail="GitHub token not configured on server"
-            )
-
-        headers = {
-            'Authorization': f'Bearer {github_token}',
-            'Accept': 'application/vnd.github.v3.diff'
-        }
-
-        # First, get the commit details to find parent
-        async with aiohttp.ClientSession() as session:
-            commit_url = f'https://api.github.com/repos/{request.owner}/{request.repo}/commits/{request.commit}'
-            async with session.get(commit_url, headers=headers) as response:
-                if response.status != 200:
-                    logger.error(f"Failed to fetch commit: {await response.text()}")
-                    raise HTTPException(
-                        status_code=response.status,
-                        detail="Failed to fetch commit details"
-                    )
-                commit_data = await response.json()
-
-            # Get the specific file diff
-            diff_url = f'https://api.github.com/repos/{request.owner}/{request.repo}/commits/{request.commit}'
-            async with session.get(diff_url, headers=headers) as response:
-                if response.status != 200:
-                    logger.error(f"Failed to fetch diff: {await response.text()}")
-                    raise HTTPException(
-                        status_code=response.status,
-                        detail="Failed to fetch diff"
-                    )
-                
-                full_diff = await response.text()
-                
-                # Parse the full diff to extract the specific file's diff
-                file_diffs = parse_diff(full_diff)
-                requested_diff = file_diffs.get(request.file)
-                
-                if not requested_diff:
-                    logger.info(f"No changes found for file: {request.file}")
-                    return {"content": "No changes found for this file"}
-                
-                return {"content": requested_diff}
-
-    except HTTPException as he:
-        raise he
-    except Exception as e:
-        logger.error(f"Error fetching diff: {str(e)}")
-        logger.error(traceback.format_exc())
+    if not _GITHUB_TOKEN:
         raise HTTPException(
             status_code=500,
-            detail=f"Failed to get diff: {str(e)}"
+            detail="GitHub token not configured on server"
         )
 
-def parse_diff(diff_content: str) -> Dict[str, str]:
-    """Parse a git diff and return a dictionary of filename -> diff content"""
-    files = {}
-    current_file = None
-    current_content = []
-    
-    for line in diff_content.split('\n'):
-        if line.startswith('diff --git'):
-            # Save previous file content if exists
-            if current_file and current_content:
-                files[current_file] = '\n'.join(current_content)
-            
-            # Start new file
-            current_content = [line]
-            # Extract filename from diff --git line
-            # Format is typically: diff --git a/path/to/file b/path/to/file
-            try:
-                current_file = line.split(' b/')[-1]
-            except:
-                current_file = None
-        elif current_file:
-            current_content.append(line)
-    
-    # Add the last file
-    if current_file and current_content:
-        files[current_file] = '\n'.join(current_content)
+    headers = _GITHUB_DIFF_HEADERS
+
+    cache_key = (request.owner, request.repo, request.commit)
+    cached = _diff_cache.get(cache_key)
+    if cached:
+        etag, file_diffs, complete = cached
+        if _SHA_RE.match(request.commit) and (complete or request.file in file_diffs):
+            return _file_diff_response(request.file, file_diffs.get(request.file))
+        # A 304 is only useful when the cached entry holds every file
+        if etag and complete:
+            headers = {**_GITHUB_DIFF_HEADERS, 'If-None-Match': etag}
+
+    session = fastapi_request.app.state.http_session
+
+    # Get the specific file diff
+    diff_url = f'https://api.github.com/repos/{request.owner}/{request.repo}/commits/{request.commit}'
+    async with session.get(diff_url, headers=headers) as response:
+        if response.status == 304 and cached:
+            return _file_diff_response(request.file, cached[1].get(request.file))
+        if response.status != 200:
+            logger.error("Failed to fetch diff: %s", await response.text())
+            raise HTTPException(
+                status_code=response.status,
+                detail="Failed to fetch diff"
+            )
+
+        # Stream the diff, stopping once the requested file's section is complete;
+        # sections read along the way are cached for other files of this commit
+        file_diffs = {}
+        complete = await _read_diff_sections(response, request.file, file_diffs)
+        _diff_cache[cache_key] = (response.headers.get('ETag'), file_diffs, complete)
+
+        return _file_diff_response(request.file, file_diffs.get(request.file))
+
+async def _read_diff_sections(response, wanted: str, file_diffs: Dict[str, bytes]) -> bool:
+    """
+    Read a streamed diff into file_diffs until the wanted file's section is complete.
+    Returns True if the whole diff was read.
+    """
+    buffer = bytearray()
+    async for chunk in response.content.iter_chunked(_DIFF_CHUNK_SIZE):
+        search_from = max(len(buffer) - len(_DIFF_HEADER), 0)
+        buffer.extend(chunk)
+        boundary = buffer.rfind(_DIFF_HEADER, search_from)
+        if boundary == -1:
+            continue
+        
+        # Every section before the last header seen is complete
+        sections = parse_diff(buffer[:boundary])
+        del buffer[:boundary + 1]
+        file_diffs.update(sections)
+        if wanted in sections:
+            return False
     
-    return files
\ No newline at end of file
+    file_diffs.update(parse_diff(buffer))
+    return True
+
+def _file_diff_response(file: str, diff: Optional[bytes]) -> DiffResponse:
+    """Build the diff endpoint response for a file's diff, decoding only that section"""
+    if not diff:
+        logger.info("No changes found for file: %s", file)
+        return DiffResponse(content="No changes found for this file")
+    return DiffResponse(content=diff.decode('utf-8', errors='replace'))
+
+def parse_diff(diff_content: bytes) -> Dict[str, bytes]:
+    """Parse a raw git diff and return a dictionary of filename -> undecoded diff content"""
+    return {
+        m.group('file').decode('utf-8', errors='replace'): m.group(0)
+        for m in _DIFF_RE.finditer(diff_content)
+    }
@@ -1,30 +1,23 @@
-from fastapi import FastAPI
-from fastapi.middleware.cors import CORSMiddleware
-from api.routes import router
 from dotenv import load_dotenv
-import os
 
-# Load environment variables
+# Load environment variables before api.routes reads them at import
 load_dotenv()
 
-# Create FastAPI app
-app = FastAPI(title="Repository Visualizer API")
-
-# Configure CORS
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["http://localhost:5173"],  # Frontend URL
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+from starlette.middleware.base import BaseHTTPMiddleware
+from api.routes import router, api_key_middleware
+import aiohttp
+import logging
+import os
 
-# Include API routes
-app.include_router(router)
+logger = logging.getLogger(__name__)
 
-# Startup event to verify environment
-@app.on_event("startup")
-async def startup_event():
+# Lifespan: verify environment and share one HTTP session across requests
+@asynccontextmanager
+async def lifespan(app: FastAPI):
     # Check for required environment variables
     required_vars = {
         "GITHUB_TOKEN": os.getenv("GITHUB_TOKEN"),
@@ -41,12 +34,60 @@ async def startup_event():
     print(f"API will be available at: http://localhost:8000")
     print(f"Documentation will be available at: http://localhost:8000/docs")
 
+    # Pooled connections to GitHub with keep-alive and DNS caching
+    app.state.http_session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=100, ttl_dns_cache=300, keepalive_timeout=75),
+        timeout=aiohttp.ClientTimeout(total=60)
+    )
+    try:
+        yield
+    finally:
+        await app.state.http_session.close()
+
+# Create FastAPI app
+app = FastAPI(
+    title="Repository Visualizer API",
+    lifespan=lifespan
+)
+
+async def error_middleware(request: Request, call_next):
+    """Log unexpected errors once and answer with a 500; HTTPException keeps FastAPI's own handler"""
+    try:
+        return await call_next(request)
+    except Exception:
+        logger.exception("Unhandled error on %s %s", request.method, request.url.path)
+        return JSONResponse(status_code=500, content={"detail": "Internal server error"})
+
+# Verify the API key before routing; added first so CORS stays the outer layer
+app.add_middleware(BaseHTTPMiddleware, dispatch=api_key_middleware)
+
+# Handle errors inside CORS so 500s still carry the CORS headers
+app.add_middleware(BaseHTTPMiddleware, dispatch=error_middleware)
+
+# Configure CORS
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["http://localhost:5173"],  # Frontend URL
+    allow_credentials=True,
+    allow_methods=["GET", "POST", "OPTIONS"],
+    allow_headers=["Content-Type", "X-API-Key", "Authorization"],
+    max_age=86400,  # Let browsers cache preflight results for a day
+)
+
+# Include API routes
+app.include_router(router)
+
 if __name__ == "__main__":
     import uvicorn
+    # RELOAD=1 keeps the single-process auto-reloading dev server
+    reload = os.getenv("RELOAD", "").lower() in ("1", "true", "yes")
     uvicorn.run(
         "main:app", 
         host="0.0.0.0", 
         port=8000, 
-        reload=True,
+        reload=reload,
+        workers=None if reload else (os.cpu_count() or 1),
+        loop="uvloop",
+        http="httptools",
         log_level="info"
     )
\ No newline at end of file
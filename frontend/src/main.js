@@ -117,7 +117,7 @@ class RepositoryVisualizer {
 
             // Make API request
             this.updateProgress(20, 'Connecting to server...');
-            const response = await fetch('/api/v1/analyze', {
+            const response = await fetch('/api/v1/analyze/stream', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json'
@@ -129,14 +129,12 @@ class RepositoryVisualizer {
                 })
             });
 
-            this.updateProgress(50, 'Processing response...');
-
             if (!response.ok) {
                 const errorText = await response.text();
                 throw new Error(errorText || 'Failed to analyze repository');
             }
 
-            const data = await response.json();
+            const data = await this.readAnalysisStream(response);
             console.log('Received visualization data:', data);
 
             if (!data.nodes || !data.edges) {
@@ -163,6 +161,60 @@ class RepositoryVisualizer {
         }
     }
 
+    async readAnalysisStream(response) {
+        // Assemble the visualization data from the server-sent events
+        const data = { nodes: [], edges: [], metrics: {} };
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const rawEvent = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+
+                let event = 'message';
+                const dataLines = [];
+                for (const line of rawEvent.split('\n')) {
+                    if (line.startsWith('event:')) {
+                        event = line.slice(6).trim();
+                    } else if (line.startsWith('data:')) {
+                        dataLines.push(line.slice(5).trim());
+                    }
+                }
+                // Comment-only events are keepalives
+                if (dataLines.length === 0) continue;
+
+                const payload = JSON.parse(dataLines.join('\n'));
+                switch (event) {
+                    case 'progress':
+                        this.updateProgress(30, payload.status);
+                        break;
+                    case 'nodes':
+                        data.nodes.push(...payload);
+                        this.updateProgress(50, `Received ${data.nodes.length} commits...`);
+                        break;
+                    case 'edges':
+                        data.edges.push(...payload);
+                        this.updateProgress(70, `Received ${data.edges.length} connections...`);
+                        break;
+                    case 'metrics':
+                        data.metrics = payload;
+                        break;
+                    case 'error':
+                        throw new Error(payload.detail || 'Failed to analyze repository');
+                }
+            }
+        }
+
+        return data;
+    }
+
     updateDiagnostics(message, type = 'info') {
         const diagnosticsContent = document.getElementById('diagnosticsContent');
         if (!diagnosticsContent) return;